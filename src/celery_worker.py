@@ -10,3 +10,23 @@ celery_app = Celery(
     backend=os.environ.get("CELERY_RESULT_BACKEND"),
     include=["tasks.processor"]
 )
+
+celery_app.conf.update(
+    # Sweeps are short and DB-bound; hand them out one at a time so a slow
+    # sweep does not hold prefetched work that an idle process could run
+    worker_prefetch_multiplier=1,
+    # Sweeps are idempotent, so acknowledge only after they finish
+    task_acks_late=True
+)
+
+# Sweep pending raw logs in batches on a fixed interval instead of once per ingest
+LOG_SWEEP_INTERVAL = float(os.environ.get("LOG_SWEEP_INTERVAL", 1.0))
+
+celery_app.conf.beat_schedule = {
+    "sweep-raw-logs": {
+        "task": "processor.process_logs",
+        "schedule": LOG_SWEEP_INTERVAL,
+        # Skip sweeps that could not start before the next one is due
+        "options": {"expires": LOG_SWEEP_INTERVAL, "ignore_result": True}
+    }
+}
@@ -1,8 +1,47 @@
-from sqlalchemy import create_engine
+import os
+import orjson
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./logs.db"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+    max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+    pool_pre_ping=False,
+    # JSON columns (RawLog.payload) are encoded/decoded with orjson
+    json_serializer=lambda value: orjson.dumps(value).decode(),
+    json_deserializer=orjson.loads
+)
+
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Tune every new SQLite connection, in both the API and the Celery worker.
+    
+    WAL lets readers (the summary endpoint) proceed while process_raw_logs
+    holds its write transaction, and with synchronous=NORMAL a commit no
+    longer waits on an fsync. cache_size is in KiB when negative (64 MiB).
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
+
+
+def get_db():
+    """Yield a database session that is closed once the request finishes."""
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -1,9 +1,42 @@
+from sqlalchemy import inspect, text
 from database.sqlite import engine, Base
-from models.logs import RawLog, JobAnalytics, TaskAnalytics
+from models.logs import RawLog, JobAnalytics, TaskAnalytics, JobMetrics, SummaryVersion
+
+# Indexes earlier versions created that no query uses any more
+_OBSOLETE_INDEXES = ("ix_raw_logs_job_event", "ix_task_analytics_job_id")
+
+def upgrade_task_analytics(connection):
+    """Prepare an existing task_analytics table for the unique task_id index.
+
+    Older databases deduplicated tasks on (task_id, job_id) only and indexed
+    task_id without a unique constraint. Keep the newest row per task_id,
+    then drop the old index so uq_task_analytics_task_id can be built.
+
+    Args:
+        connection: Open connection inside a transaction
+    """
+    if not inspect(connection).has_table("task_analytics"):
+        return
+    removed = connection.execute(text(
+        "DELETE FROM task_analytics WHERE task_id IS NOT NULL AND id NOT IN ("
+        "SELECT MAX(id) FROM task_analytics WHERE task_id IS NOT NULL GROUP BY task_id)"
+    )).rowcount
+    if removed:
+        print(f"Removed {removed} duplicate task_analytics rows")
+    connection.execute(text("DROP INDEX IF EXISTS ix_task_analytics_task_id"))
 
 def init_db():
     print("Creating database tables...")
+    # Runs before create_all so the job_metrics rebuild sees deduplicated tasks
+    with engine.begin() as connection:
+        upgrade_task_analytics(connection)
+        for name in _OBSOLETE_INDEXES:
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
     Base.metadata.create_all(bind=engine)
+    # create_all skips existing tables, so add any indexes they are missing
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
     print("Database tables created successfully!")
 
 if __name__ == "__main__":
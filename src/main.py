@@ -1,8 +1,14 @@
+import logging
+
 from fastapi import FastAPI
 
 from routes import logs
 
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
 app = FastAPI()
 
 app.include_router(logs.router)
-
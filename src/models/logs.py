@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import List, Optional
-from pydantic import BaseModel
-from sqlalchemy import Column, Integer, String, Boolean,  JSON
+from pydantic import BaseModel, ConfigDict, field_serializer
+from sqlalchemy import Column, DateTime, Index, Integer, String, Boolean,  JSON, event, text
 from database.sqlite import Base
 
 class RawLog(Base):
@@ -13,13 +13,18 @@ class RawLog(Base):
     payload = Column(JSON)
     processed = Column(Boolean, default=False)
 
+    __table_args__ = (
+        # Partial index so the worker's unprocessed-log query only reads pending rows
+        Index("ix_raw_logs_unprocessed", "id", sqlite_where=text("processed = 0")),
+    )
+
 class JobAnalytics(Base):
     __tablename__ = "job_analytics"
 
     job_id = Column(Integer, primary_key=True, index=True)
     user = Column(String, index=True)
-    start_time = Column(String)
-    end_time = Column(String)
+    start_time = Column(DateTime, index=True)  # Naive UTC
+    end_time = Column(DateTime)  # Naive UTC
     status = Column(String)
 
 
@@ -27,31 +32,120 @@ class TaskAnalytics(Base):
     __tablename__ = "task_analytics"
 
     id = Column(Integer, primary_key=True, index=True)
-    task_id = Column(String, index=True)
+    task_id = Column(String)
     job_id = Column(Integer)
-    timestamp = Column(String)
+    timestamp = Column(DateTime)  # Naive UTC
     duration_ms = Column(Integer)
     successful = Column(Boolean)
 
+    __table_args__ = (
+        # Conflict target of the worker's task upsert. Named apart from the
+        # older non-unique ix_task_analytics_task_id so init_db can replace it.
+        Index("uq_task_analytics_task_id", "task_id", unique=True),
+    )
+
+
+class SummaryVersion(Base):
+    """Per-date counter bumped by the worker whenever that day's analytics change"""
+    __tablename__ = "summary_versions"
+
+    date = Column(String, primary_key=True)  # YYYY-MM-DD, UTC date of job start_time
+    version = Column(Integer, nullable=False, default=0)
+
+
+class JobMetrics(Base):
+    """Per-job task counts, kept in step with task_analytics by SQLite triggers"""
+    __tablename__ = "job_metrics"
+
+    job_id = Column(Integer, primary_key=True)
+    task_count = Column(Integer, nullable=False, default=0)
+    failed_tasks = Column(Integer, nullable=False, default=0)
+
+
+# A task counts as failed unless successful is true; NULL counts as a failure
+_TASK_FAILED = "CASE WHEN COALESCE({row}.successful, 0) = 0 THEN 1 ELSE 0 END"
+
+_JOB_METRICS_TRIGGERS = {
+    "job_metrics_task_insert": f"""
+    AFTER INSERT ON task_analytics WHEN NEW.job_id IS NOT NULL
+    BEGIN
+        INSERT INTO job_metrics (job_id, task_count, failed_tasks)
+        VALUES (NEW.job_id, 1, {_TASK_FAILED.format(row="NEW")})
+        ON CONFLICT (job_id) DO UPDATE SET
+            task_count = task_count + 1,
+            failed_tasks = failed_tasks + excluded.failed_tasks;
+    END
+    """,
+    "job_metrics_task_update": f"""
+    AFTER UPDATE OF job_id, successful ON task_analytics
+    BEGIN
+        UPDATE job_metrics SET
+            task_count = task_count - 1,
+            failed_tasks = failed_tasks - {_TASK_FAILED.format(row="OLD")}
+        WHERE job_id = OLD.job_id;
+        INSERT INTO job_metrics (job_id, task_count, failed_tasks)
+        SELECT NEW.job_id, 1, {_TASK_FAILED.format(row="NEW")}
+        WHERE NEW.job_id IS NOT NULL
+        ON CONFLICT (job_id) DO UPDATE SET
+            task_count = task_count + 1,
+            failed_tasks = failed_tasks + excluded.failed_tasks;
+    END
+    """,
+    "job_metrics_task_delete": f"""
+    AFTER DELETE ON task_analytics
+    BEGIN
+        UPDATE job_metrics SET
+            task_count = task_count - 1,
+            failed_tasks = failed_tasks - {_TASK_FAILED.format(row="OLD")}
+        WHERE job_id = OLD.job_id;
+    END
+    """,
+}
+
+
+@event.listens_for(Base.metadata, "after_create")
+def create_job_metrics_triggers(target, connection, **kw):
+    """
+    (Re)install the job_metrics triggers and rebuild the table from task_analytics.
+    
+    Runs on every init_db, so existing databases pick up the table, the
+    current trigger definitions and correct counts; init_db must be rerun
+    after upgrading.
+    """
+    for name, body in _JOB_METRICS_TRIGGERS.items():
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+        connection.exec_driver_sql(f"CREATE TRIGGER {name} {body}")
+    connection.exec_driver_sql("DELETE FROM job_metrics")
+    connection.exec_driver_sql(
+        f"""
+        INSERT INTO job_metrics (job_id, task_count, failed_tasks)
+        SELECT job_id, COUNT(*), SUM({_TASK_FAILED.format(row="task_analytics")})
+        FROM task_analytics
+        WHERE job_id IS NOT NULL
+        GROUP BY job_id
+        """
+    )
+
 
 # Pydantic models for API responses
 class JobSummary(BaseModel):
     """Summary of a single job's analytics"""
     job_id: int
     user: Optional[str]
-    start_time: Optional[str]
-    end_time: Optional[str]
+    start_time: Optional[datetime]
+    end_time: Optional[datetime]
     status: Optional[str]
     task_count: int
     failed_tasks: int
     success_rate: float
     duration_seconds: Optional[int]
 
-    class Config:
-        orm_mode = True
-        json_encoders = {
-            datetime: lambda v: v.isoformat() if v else None
-        }
+    model_config = ConfigDict(from_attributes=True)
+
+    @field_serializer("success_rate")
+    def round_rate(self, value: float) -> float:
+        """Round to 2 decimals on output only."""
+        return round(value, 2)
 
 
 class AnalyticsSummary(BaseModel):
@@ -62,10 +156,12 @@ class AnalyticsSummary(BaseModel):
     avg_success_rate: float
     avg_duration_seconds: float
 
-    class Config:
-        json_encoders = {
-            float: lambda v: round(v, 2)
-        }
+    model_config = ConfigDict(frozen=True)
+
+    @field_serializer("avg_success_rate", "avg_duration_seconds")
+    def round_averages(self, value: float) -> float:
+        """Round to 2 decimals on output only."""
+        return round(value, 2)
 
 
 class AnalyticsResponse(BaseModel):
@@ -73,8 +169,3 @@ class AnalyticsResponse(BaseModel):
     date: str
     summary: AnalyticsSummary
     jobs: List[JobSummary]
-
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat() if v else None
-        }
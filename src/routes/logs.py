@@ -1,33 +1,102 @@
+import asyncio
+import calendar
 import logging
+import re
 import time
 import uuid
-from typing import Dict, Any, Optional, Union
-from fastapi import APIRouter, Request, Query, status, HTTPException
-from fastapi.responses import JSONResponse
-from datetime import datetime
+import orjson
+from typing import Dict, Any, List, Optional, Tuple
+from fastapi import APIRouter, Depends, Request, Query, status, HTTPException
+from fastapi.responses import ORJSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from celery.result import AsyncResult
+from sqlalchemy.orm import Session
 
+from celery_worker import celery_app
+from database.sqlite import get_db
 from models.logs import AnalyticsResponse
-from tasks.processor import process_logs
 from service.logs import get_analytics_summary_service, handle_ingest_log
+from tasks.processor import process_logs
 
-# Configure logging
+# Handlers and format are configured once by the application entry point
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
-# Create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
+# YYYY-MM-DD, with the parts captured for range checks
+_DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})", re.ASCII)
+
+def _is_valid_date(date: str) -> bool:
+    """Check that a string is a real calendar date in YYYY-MM-DD format."""
+    match = _DATE_RE.fullmatch(date)
+    if not match:
+        return False
+    year, month, day = int(match[1]), int(match[2]), int(match[3])
+    return year >= 1 and 1 <= month <= 12 and 1 <= day <= calendar.monthrange(year, month)[1]
 
-# Create formatter and add it to the handlers
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
+# Seconds to wait on the result backend for a task that reports ready
+TASK_RESULT_TIMEOUT = 1.0
 
-# Add the handlers to the logger
-logger.addHandler(ch)
+# Ingested log IDs are handed to Celery in batches: one task per this many
+# IDs, or per interval (seconds) when traffic is lower
+PROCESS_BATCH_SIZE = 100
+PROCESS_BATCH_INTERVAL = 0.05
+
+_pending_log_ids: List[int] = []
+# Celery task ID for the pending batch, handed out to its ingest requests
+_pending_task_id: Optional[str] = None
+_flush_handle: Optional[asyncio.TimerHandle] = None
+
+def _send_process_logs(log_ids: List[int], task_id: str) -> None:
+    """Enqueue one processing task for a batch of raw log IDs."""
+    try:
+        process_logs.apply_async((log_ids,), task_id=task_id)
+    except Exception as e:
+        # The periodic sweep still picks these logs up
+        logger.error("Failed to enqueue processing for %d logs: %s", len(log_ids), e)
+
+def _flush_pending_logs() -> None:
+    """Send the pending log IDs to Celery without blocking the event loop."""
+    global _flush_handle, _pending_task_id
+    if _flush_handle is not None:
+        _flush_handle.cancel()
+        _flush_handle = None
+    if not _pending_log_ids:
+        return
+    log_ids = _pending_log_ids.copy()
+    task_id = _pending_task_id
+    _pending_log_ids.clear()
+    _pending_task_id = None
+    asyncio.get_running_loop().run_in_executor(None, _send_process_logs, log_ids, task_id)
+
+def _schedule_processing(log_id: int) -> str:
+    """
+    Queue a raw log ID for the next processing batch.
+    
+    Returns:
+        The Celery task ID the batch will be sent under
+    """
+    global _flush_handle, _pending_task_id
+    if _pending_task_id is None:
+        _pending_task_id = str(uuid.uuid4())
+    task_id = _pending_task_id
+    _pending_log_ids.append(log_id)
+    if len(_pending_log_ids) >= PROCESS_BATCH_SIZE:
+        _flush_pending_logs()
+    elif _flush_handle is None:
+        _flush_handle = asyncio.get_running_loop().call_later(
+            PROCESS_BATCH_INTERVAL, _flush_pending_logs
+        )
+    return task_id
+
+# Static, so encoded once instead of on every health check
+_HEALTH_BODY = orjson.dumps({
+    "status": "ok",
+    "service": "Log Analytics API",
+    "version": "1.0.0"
+})
 
 router = APIRouter(
     tags=["logs"],
+    default_response_class=ORJSONResponse,
     responses={
         status.HTTP_500_INTERNAL_SERVER_ERROR: {"description": "Internal server error"}
     }
@@ -39,51 +108,55 @@ router = APIRouter(
     summary="Ingest log data",
     response_description="Log ingestion initiated"
 )
-async def ingest_log(request: Request) -> Dict[str, Any]:
+async def ingest_log(request: Request, db: Session = Depends(get_db)) -> Dict[str, Any]:
     """
     Ingest log data for processing.
     
-    This endpoint accepts log data in JSON format and initiates asynchronous processing.
+    This endpoint accepts log data in JSON format and stores it for asynchronous
+    processing. Stored logs are sent to Celery in small batches; the periodic
+    sweep picks up any that were not.
     
     Args:
         request: The incoming HTTP request containing log data
+        db: Database session for the request
         
     Returns:
-        Dict containing status and task ID for tracking
+        Dict containing the ingestion status and the task_id of the batch
+        processing task, for use with /analytics/jobs/{job_id}
         
     Raises:
         HTTPException: If there's an error processing the request
     """
     start_time = time.time()
     
-    logger.info(f"Received log ingestion request")
-    
+    logger.info("Received log ingestion request")
+
+    # Parse request body
     try:
-        # Parse request body
-        log = await request.json()
-        logger.debug("Parsed request data")
-        
-        # Handle log ingestion
-        error_response = handle_ingest_log(log)
-        if error_response:
-            logger.warning(
-                f"Log ingestion validation failed: "
-                f"{error_response.status_code} - {error_response.body.decode()}"
-            )
-            return error_response
-        
-        # Start async processing
-        task = process_logs.delay()
-        task_id = str(task)
-        
-        logger.info(
-            f"Successfully queued log for processing. "
-            f"Task ID: {task_id}"
+        log = orjson.loads(await request.body())
+    except orjson.JSONDecodeError as e:
+        logger.warning("Invalid JSON in log ingestion request: %s", e)
+        return ORJSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"error": "Request body must be valid JSON"}
         )
+    logger.debug("Parsed request data")
+
+    try:
+        # Handle log ingestion off the event loop; the database calls block
+        result = await run_in_threadpool(handle_ingest_log, log, db)
+        if isinstance(result, ORJSONResponse):
+            # The service has already logged the error message
+            logger.warning("Log ingestion validation failed: %s", result.status_code)
+            return result
+        
+        task_id = _schedule_processing(result)
+        logger.info("Successfully stored log for processing")
         
         # Log performance
-        duration = (time.time() - start_time) * 1000  # Convert to milliseconds
-        logger.debug(f"Request processed in {duration:.2f}ms")
+        if logger.isEnabledFor(logging.DEBUG):
+            duration = (time.time() - start_time) * 1000  # Convert to milliseconds
+            logger.debug("Request processed in %.2fms", duration)
         
         return {
             "status": "accepted",
@@ -92,7 +165,7 @@ async def ingest_log(request: Request) -> Dict[str, Any]:
         
     except Exception as e:
         logger.error(
-            f"Error processing log ingestion: {str(e)}",
+            "Error processing log ingestion: %s", e,
             exc_info=True
         )
         raise HTTPException(
@@ -100,6 +173,12 @@ async def ingest_log(request: Request) -> Dict[str, Any]:
             detail="An error occurred while processing your request"
         )
 
+def _fetch_task_result(task: AsyncResult) -> Tuple[bool, Any]:
+    """Return whether a Celery task has finished and its result, blocking on the backend."""
+    if not task.ready():
+        return False, None
+    return True, task.get(timeout=TASK_RESULT_TIMEOUT)
+
 @router.get(
     "/analytics/jobs/{job_id}",
     summary="Get job analytics by ID",
@@ -122,16 +201,17 @@ async def get_job_analytics(
     Raises:
         HTTPException: If the job is not found or an error occurs
     """
-    logger.info(f"Fetching analytics for job: {job_id}")
+    logger.info("Fetching analytics for job: %s", job_id)
     
     try:
-        # Get task status
-        task = AsyncResult(str(job_id))
+        # Get task status and result off the event loop; both read the result backend
+        task = AsyncResult(str(job_id), app=celery_app)
+        ready, result = await run_in_threadpool(_fetch_task_result, task)
         
         # If task is still processing
-        if not task.ready():
-            logger.info(f"Job {job_id} is still processing")
-            return JSONResponse(
+        if not ready:
+            logger.info("Job %s is still processing", job_id)
+            return ORJSONResponse(
                 status_code=status.HTTP_202_ACCEPTED,
                 content={
                     "task_id": str(job_id),
@@ -139,11 +219,7 @@ async def get_job_analytics(
                 },
             )
         
-        # Get task result
-        logger.debug(f"Retrieving result for job: {job_id}")
-        result = task.get()
-        
-        logger.info(f"Successfully retrieved analytics for job: {job_id}")
+        logger.info("Successfully retrieved analytics for job: %s", job_id)
         return {
             "task_id": job_id,
             "status": "success",
@@ -152,7 +228,7 @@ async def get_job_analytics(
         
     except Exception as e:
         logger.error(
-            f"Error fetching analytics for job {job_id}: {str(e)}",
+            "Error fetching analytics for job %s: %s", job_id, e,
             exc_info=True
         )
         raise HTTPException(
@@ -163,18 +239,22 @@ async def get_job_analytics(
 
 @router.get(
     "/analytics/summary",
-    response_model=AnalyticsResponse,
+    # Documented only: the service already returns validated data, which is
+    # sent as-is instead of being re-validated against a response_model
+    responses={status.HTTP_200_OK: {"model": AnalyticsResponse}},
     summary="Get analytics summary for a date",
     response_description="Analytics summary data"
 )
 async def get_analytics_summary(
     date: str = Query(..., description="Date in YYYY-MM-DD format"),
-) -> Union[AnalyticsResponse, JSONResponse]:
+    db: Session = Depends(get_db)
+) -> ORJSONResponse:
     """
     Get analytics summary for a specific date.
     
     Args:
         date: The date to get analytics for (format: YYYY-MM-DD)
+        db: Database session for the request
         
     Returns:
         Analytics summary data for the specified date
@@ -182,14 +262,12 @@ async def get_analytics_summary(
     Raises:
         HTTPException: If the date format is invalid or an error occurs
     """
-    logger.info(f"Fetching analytics summary for date: {date}")
+    logger.info("Fetching analytics summary for date: %s", date)
     
     # Validate date format
-    try:
-        datetime.strptime(date, "%Y-%m-%d")
-    except ValueError as e:
+    if not _is_valid_date(date):
         error_msg = f"Invalid date format: {date}. Use YYYY-MM-DD"
-        logger.warning(f"{error_msg}")
+        logger.warning(error_msg)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail={"error": error_msg}
@@ -197,33 +275,34 @@ async def get_analytics_summary(
     
     try:
         start_time = time.time()
-        logger.debug(f"Starting to process analytics for {date}")
+        logger.debug("Starting to process analytics for %s", date)
         
-        # Get analytics data
-        result = get_analytics_summary_service(date)
+        # Get analytics data off the event loop; the database calls block
+        result = await run_in_threadpool(get_analytics_summary_service, date, db)
+        if "error" in result:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=result
+            )
         
         # Log performance
         duration = (time.time() - start_time) * 1000  # Convert to milliseconds
         logger.info(
-            f"Successfully retrieved analytics for {date} "
-            f"in {duration:.2f}ms"
+            "Successfully retrieved analytics for %s in %.2fms", date, duration
         )
         
-        return result
+        return ORJSONResponse(result)
         
     except HTTPException as he:
         # Re-raise HTTP exceptions as-is
         logger.warning(
-            f"HTTP error in analytics summary for {date}: "
-            f"{he.status_code} - {he.detail}"
+            "HTTP error in analytics summary for %s: %s - %s",
+            date, he.status_code, he.detail
         )
         raise
     except Exception as e:
         error_msg = f"Error generating analytics summary: {str(e)}"
-        logger.error(
-            f"{error_msg}",
-            exc_info=True
-        )
+        logger.error(error_msg, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail={"error": error_msg}
@@ -234,17 +313,13 @@ async def get_analytics_summary(
     summary="Health check endpoint",
     response_description="Service health status"
 )
-async def health_check() -> Dict[str, str]:
+async def health_check() -> Response:
     """
     Health check endpoint to verify the service is running.
     
     Returns:
-        Dict containing the service status
+        Response with the precomputed service status body
     """
     logger.debug("Health check request received")
-    return {
-        "status": "ok",
-        "service": "Log Analytics API",
-        "version": "1.0.0",
-        "timestamp": datetime.utcnow().isoformat()
-    }
+    # A fresh response per request; response objects are mutable
+    return Response(content=_HEALTH_BODY, media_type="application/json")
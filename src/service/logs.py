@@ -1,202 +1,363 @@
 import logging
-from typing import Dict, Any, Optional, List, Union
-from starlette.responses import JSONResponse
+from collections import defaultdict
+from typing import Callable, Dict, Any, Optional, List, Set, Tuple, Union
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import exists, func, insert, inspect, literal, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import Exists
 from database.sqlite import SessionLocal
-from models.logs import RawLog, JobAnalytics, TaskAnalytics
-from utils.logs import get_analytics_summary_data
+from models.logs import RawLog, JobAnalytics, SummaryVersion, TaskAnalytics
+from utils.logs import _as_utc, get_analytics_summary_data, parse_timestamp
 
-# Configure logging
+# Handlers and format are configured once by the application entry point
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
-# Create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
+# Maximum number of raw logs claimed by one processing run
+RAW_LOG_BATCH_SIZE = 500
 
-# Create formatter and add it to the handlers
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
+# Set once has_task_id_unique_index finds the index upserts conflict on
+_task_id_unique_index_found = False
 
-# Add the handlers to the logger
-logger.addHandler(ch)
-
-def handle_ingest_log(log: Dict[str, Any]) -> Optional[JSONResponse]:
+def handle_ingest_log(log: Dict[str, Any], db: Session) -> Union[int, ORJSONResponse]:
     """
     Handle incoming log ingestion request.
     
+    The idempotency check and the insert run as a single conditional
+    INSERT ... SELECT ... WHERE NOT EXISTS statement, so each log costs one
+    round trip and one commit.
+    
     Args:
         log: Dictionary containing log data
+        db: Database session
         
     Returns:
-        JSONResponse: If there's an error, None otherwise
+        int: ID of the stored raw log, or
+        ORJSONResponse: If there's an error
     """
-    logger.info(f"Processing log ingestion for job_id: {log.get('job_id')}, event: {log.get('event')}")
-    db = SessionLocal()
+    logger.info("Processing log ingestion for job_id: %s, event: %s", log.get("job_id"), log.get("event"))
     try:
-        # Check for idempotency
-        error = check_idempotency(log, db)
-        if error:
-            logger.warning(f"Idempotency check failed: {error.status_code} - {error.body.decode()}")
-            return error
-            
-        # Save raw log
-        db_log = RawLog(job_id=log["job_id"], event=log["event"], payload=log)
-        db.add(db_log)
+        duplicate, error_msg = get_duplicate_clause(log)
+        
+        # Save raw log unless it duplicates an already processed event
+        row = select(
+            literal(log["job_id"], RawLog.__table__.c.job_id.type),
+            literal(log["event"], RawLog.__table__.c.event.type),
+            literal(log, RawLog.__table__.c.payload.type),
+            literal(False, RawLog.__table__.c.processed.type)
+        )
+        if duplicate is not None:
+            row = row.where(~duplicate)
+        stmt = (
+            insert(RawLog)
+            .from_select(["job_id", "event", "payload", "processed"], row)
+            .returning(RawLog.id)
+        )
+        
+        log_id = db.execute(stmt).scalar_one_or_none()
+        if log_id is None:
+            db.rollback()
+            logger.warning("Idempotency check failed: 400 - %s", error_msg)
+            return ORJSONResponse(
+                status_code=400,
+                content={"error": error_msg}
+            )
+        
         db.commit()
-        logger.info(f"Successfully saved raw log for job_id: {log.get('job_id')}")
+        logger.info("Successfully saved raw log for job_id: %s", log.get("job_id"))
         
     except Exception as e:
         db.rollback()
-        logger.error(f"Error processing log ingestion: {str(e)}", exc_info=True)
-        return JSONResponse(
+        logger.error("Error processing log ingestion: %s", e, exc_info=True)
+        return ORJSONResponse(
             status_code=500,
             content={"error": "Internal server error while processing log"}
         )
-    finally:
-        db.close()
-    return None
+    return log_id
 
-def check_idempotency(log: Dict[str, Any], db) -> Optional[JSONResponse]:
+def get_duplicate_clause(log: Dict[str, Any]) -> Tuple[Optional[Exists], Optional[str]]:
     """
-    Check for duplicate or conflicting log entries.
+    Build the EXISTS clause that identifies a duplicate or conflicting log entry.
     
     Args:
         log: Dictionary containing log data
-        db: Database session
         
     Returns:
-        JSONResponse: If idempotency check fails, None otherwise
+        Tuple of the EXISTS clause and the error message to report when it
+        matches, or (None, None) if the event is not subject to idempotency checks
     """
     event_type = log.get("event")
     job_id = log.get("job_id")
     
-    logger.debug(f"Checking idempotency for job_id: {job_id}, event: {event_type}")
+    logger.debug("Building idempotency check for job_id: %s, event: %s", job_id, event_type)
     
-    try:
-        if event_type == "SparkListenerJobStart":
-            job = db.query(JobAnalytics).filter(JobAnalytics.job_id == job_id).first()
-            if job and job.status == "processing":
-                logger.warning(f"Duplicate job start for job_id: {job_id}")
-                return JSONResponse(
-                    status_code=400,
-                    content={"error": "Job is already being processed"}
-                )
+    if event_type == "SparkListenerJobStart":
+        return (
+            exists().where(JobAnalytics.job_id == job_id, JobAnalytics.status == "processing"),
+            "Job is already being processed"
+        )
 
-        elif event_type == "SparkListenerJobEnd":
-            job = db.query(JobAnalytics).filter(JobAnalytics.job_id == job_id).first()
-            if job and job.status == "success":
-                logger.warning(f"Duplicate job end for completed job_id: {job_id}")
-                return JSONResponse(
-                    status_code=400,
-                    content={"error": "Job has already completed successfully"}
-                )
+    elif event_type == "SparkListenerJobEnd":
+        return (
+            exists().where(JobAnalytics.job_id == job_id, JobAnalytics.status == "success"),
+            "Job has already completed successfully"
+        )
 
-        elif event_type == "SparkListenerTaskEnd":
-            task_id = log.get("task_id")
-            if task_id and db.query(TaskAnalytics).filter(TaskAnalytics.task_id == task_id).first():
-                logger.warning(f"Duplicate task end for task_id: {task_id}")
-                return JSONResponse(
-                    status_code=400,
-                    content={"error": "Task has already been processed"}
-                )
-                
-    except Exception as e:
-        logger.error(f"Error during idempotency check: {str(e)}", exc_info=True)
-        # Don't fail the request if idempotency check itself fails
+    elif event_type == "SparkListenerTaskEnd":
+        task_id = log.get("task_id")
+        if task_id:
+            return (
+                exists().where(TaskAnalytics.task_id == task_id),
+                "Task has already been processed"
+            )
         
-    return None
+    return None, None
 
-def get_analytics_summary_service(date: str) -> Dict[str, Any]:
+def get_analytics_summary_service(date: str, db: Session) -> Dict[str, Any]:
     """
     Get analytics summary for a specific date.
     
+    Results are plain dicts ready for JSON encoding.
+    
     Args:
         date: Date string in YYYY-MM-DD format
+        db: Database session
         
     Returns:
         Dictionary containing analytics data
     """
-    logger.info(f"Fetching analytics summary for date: {date}")
-    db = SessionLocal()
+    logger.info("Fetching analytics summary for date: %s", date)
     try:
         result = get_analytics_summary_data(db, date)
-        logger.info(f"Successfully retrieved analytics for {date}")
+        logger.info("Successfully retrieved analytics for %s", date)
         return result
     except Exception as e:
-        logger.error(f"Error fetching analytics for date {date}: {str(e)}", exc_info=True)
+        logger.error("Error fetching analytics for date %s: %s", date, e, exc_info=True)
         return {"error": "Failed to fetch analytics data"}
-    finally:
-        db.close()
 
-def process_raw_logs() -> List[Dict[str, Any]]:
+def process_raw_logs(log_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
     """
-    Process all unprocessed raw logs.
+    Process the next batch of unprocessed raw logs.
+    
+    The batch is claimed and processed in one transaction that is committed
+    when the session block exits and rolled back if it raises.
+    
+    Args:
+        log_ids: Raw log IDs to process; any of them already claimed by an
+            earlier run are skipped. If None, the oldest unprocessed logs
+            are swept instead.
     
     Returns:
         List of processing results
     """
     logger.info("Starting raw log processing")
-    db = SessionLocal()
     analytics_results = []
     processed_count = 0
     error_count = 0
     
     try:
-        # Get all unprocessed logs
-        logs = db.query(RawLog).filter(RawLog.processed == False).all()
-        total_logs = len(logs)
-        logger.info(f"Found {total_logs} unprocessed logs")
-        
-        if not total_logs:
-            return []
+        with SessionLocal.begin() as db:
+            if not has_task_id_unique_index(db):
+                # Leave the logs unclaimed so they are processed once the
+                # database is upgraded, instead of failing batch after batch
+                logger.critical(
+                    "task_analytics.task_id has no unique index; run init_db.py before processing logs"
+                )
+                return []
+            
+            # Claim up to a batch of unprocessed logs by flagging them in the
+            # same statement that reads them. Concurrent sweeps then skip these
+            # rows, and a failure rolls the claim back. Failed logs stay
+            # flagged to prevent infinite retries.
+            pending = (
+                select(RawLog.id)
+                .where(RawLog.processed == False)
+                .order_by(RawLog.id)
+                .limit(RAW_LOG_BATCH_SIZE)
+            )
+            if log_ids is not None:
+                pending = pending.where(RawLog.id.in_(log_ids))
+            claimed = db.scalars(
+                update(RawLog)
+                .where(RawLog.id.in_(pending))
+                .values(processed=True)
+                .returning(RawLog)
+            ).all()
+            # RETURNING order is unspecified; events must be applied in arrival order
+            logs = sorted(claimed, key=lambda log: log.id)
+            total_logs = len(logs)
+            logger.info("Claimed %d unprocessed logs", total_logs)
             
-        # Process each log
-        for log in logs:
-            try:
-                result = process_log_entry(log, db)
-                if result:
-                    analytics_results.append(result)
-                log.processed = True
-                processed_count += 1
+            if not total_logs:
+                return []
+            
+            # Analytics rows built from this batch, keyed by job_id and task_id
+            jobs = {}
+            tasks = {}
                 
-                # Log progress periodically
-                if processed_count % 10 == 0:
-                    logger.info(f"Processed {processed_count}/{total_logs} logs")
+            # Process each log
+            for log in logs:
+                try:
+                    result = process_log_entry(log, jobs, tasks)
+                    if result:
+                        analytics_results.append(result)
+                    processed_count += 1
                     
-            except Exception as e:
-                error_count += 1
-                log.processed = True  # Mark as processed to prevent infinite retries
-                logger.error(f"Error processing log ID {log.id}: {str(e)}", exc_info=True)
-                
-        # Commit all changes
-        db.commit()
+                    # Log progress periodically
+                    if processed_count % 10 == 0:
+                        logger.info("Processed %d/%d logs", processed_count, total_logs)
+                        
+                except Exception as e:
+                    error_count += 1
+                    logger.error("Error processing log ID %s: %s", log.id, e, exc_info=True)
+            
+            # Summaries group jobs by the UTC date of start_time. A batch can
+            # move a job's start as well as change its counts, so the start
+            # dates from before and after the writes are both marked stale.
+            touched_job_ids = set(jobs) | {task["job_id"] for task in tasks.values()}
+            stale_dates = get_job_start_dates(touched_job_ids, db)
+            
+            # Write the batch's analytics with one upsert per row shape
+            upsert_job_analytics(jobs, db)
+            upsert_task_analytics(tasks, db)
+            
+            stale_dates |= get_job_start_dates(touched_job_ids, db)
+            bump_summary_versions(stale_dates, db)
         
         # Log summary
         success_rate = (processed_count / total_logs * 100) if total_logs > 0 else 0
         logger.info(
-            f"Completed log processing. "
-            f"Total: {total_logs}, "
-            f"Processed: {processed_count}, "
-            f"Errors: {error_count}, "
-            f"Success rate: {success_rate:.2f}%"
+            "Completed log processing. Total: %d, Processed: %d, Errors: %d, Success rate: %.2f%%",
+            total_logs, processed_count, error_count, success_rate
         )
         
     except Exception as e:
-        db.rollback()
-        logger.critical(f"Critical error during log processing: {str(e)}", exc_info=True)
-    finally:
-        db.close()
+        logger.critical("Critical error during log processing: %s", e, exc_info=True)
         
     return analytics_results
 
-def process_log_entry(log: RawLog, db) -> Optional[Dict[str, Any]]:
+def upsert_job_analytics(jobs: Dict[int, Dict[str, Any]], db: Session) -> None:
     """
-    Process a single log entry and update the database accordingly.
+    Insert or update job analytics rows with INSERT ... ON CONFLICT DO UPDATE.
+    
+    Rows only carry the columns their events set. Rows are grouped by
+    those columns so each group is a single executemany upsert.
+    
+    Args:
+        jobs: Job analytics column values keyed by job_id
+        db: Database session
+    """
+    shapes = defaultdict(list)
+    for row in jobs.values():
+        shapes[frozenset(row)].append(row)
+    
+    for columns, rows in shapes.items():
+        stmt = sqlite_insert(JobAnalytics)
+        set_ = {column: stmt.excluded[column] for column in columns if column != "job_id"}
+        if "end_time" not in columns:
+            # Without a job end in the batch, keep any status the job already has
+            set_["status"] = func.coalesce(JobAnalytics.status, stmt.excluded.status)
+        db.execute(stmt.on_conflict_do_update(index_elements=["job_id"], set_=set_), rows)
+
+def get_job_start_dates(job_ids: Set[int], db: Session) -> Set[str]:
+    """
+    Get the UTC start dates (YYYY-MM-DD) of the given jobs.
+    
+    Args:
+        job_ids: IDs of the jobs to look up
+        db: Database session
+        
+    Returns:
+        Set of start dates; jobs without a start time are skipped
+    """
+    job_ids = [job_id for job_id in job_ids if job_id is not None]
+    if not job_ids:
+        return set()
+    return set(db.scalars(
+        select(func.date(JobAnalytics.start_time))
+        .where(JobAnalytics.job_id.in_(job_ids), JobAnalytics.start_time.is_not(None))
+        .distinct()
+    ))
+
+def bump_summary_versions(dates: Set[str], db: Session) -> None:
+    """
+    Mark the analytics summaries for the given dates as stale.
+    
+    Runs in the same transaction as the analytics writes, so readers in any
+    process see the new version exactly when they can see the new data.
+    
+    Args:
+        dates: Dates (YYYY-MM-DD) whose summaries changed
+        db: Database session
+    """
+    if not dates:
+        return
+    stmt = sqlite_insert(SummaryVersion).values(
+        [{"date": date, "version": 1} for date in dates]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["date"],
+        set_={"version": SummaryVersion.version + 1}
+    )
+    db.execute(stmt)
+
+def has_task_id_unique_index(db: Session) -> bool:
+    """
+    Check that task_analytics has the unique task_id index that
+    upsert_task_analytics uses as its conflict target.
+    
+    Databases created before the index existed need init_db rerun. Once
+    the index is found the result is remembered for the process.
     
     Args:
-        log: RawLog object to process
         db: Database session
         
+    Returns:
+        True if the unique index exists
+    """
+    global _task_id_unique_index_found
+    if not _task_id_unique_index_found:
+        _task_id_unique_index_found = any(
+            index["unique"] and index["column_names"] == ["task_id"]
+            for index in inspect(db.connection()).get_indexes("task_analytics")
+        )
+    return _task_id_unique_index_found
+
+def upsert_task_analytics(tasks: Dict[str, Dict[str, Any]], db: Session) -> None:
+    """
+    Insert or update task analytics rows with INSERT ... ON CONFLICT DO UPDATE.
+    
+    Args:
+        tasks: Task analytics column values keyed by task_id
+        db: Database session
+    """
+    if not tasks:
+        return
+    stmt = sqlite_insert(TaskAnalytics)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["task_id"],
+        set_={
+            "job_id": stmt.excluded.job_id,
+            "timestamp": stmt.excluded.timestamp,
+            "duration_ms": stmt.excluded.duration_ms,
+            "successful": stmt.excluded.successful
+        }
+    )
+    db.execute(stmt, list(tasks.values()))
+
+def process_log_entry(
+    log: RawLog,
+    jobs: Dict[int, Dict[str, Any]],
+    tasks: Dict[str, Dict[str, Any]]
+) -> Optional[Dict[str, Any]]:
+    """
+    Process a single log entry and update the batch's analytics accordingly.
+    
+    Args:
+        log: RawLog object to process
+        jobs: Job analytics column values keyed by job_id, updated in place
+        tasks: Task analytics column values keyed by task_id, updated in place
+        
     Returns:
         Dictionary with processing results or None if not processed
     """
@@ -204,95 +365,89 @@ def process_log_entry(log: RawLog, db) -> Optional[Dict[str, Any]]:
     event_type = data.get("event")
     job_id = log.job_id
     
-    logger.debug(f"Processing log entry - ID: {log.id}, Job: {job_id}, Event: {event_type}")
+    logger.debug("Processing log entry - ID: %s, Job: %s, Event: %s", log.id, job_id, event_type)
+    
+    handler = _HANDLERS.get(event_type)
+    if handler is None:
+        logger.warning("Unhandled event type: %s", event_type)
+        return None
     
     try:
-        if event_type == "SparkListenerJobStart":
-            return _process_job_start(log, data, db)
-            
-        elif event_type == "SparkListenerJobEnd":
-            return _process_job_end(log, data, db)
-            
-        elif event_type == "SparkListenerTaskEnd":
-            return _process_task_end(log, data, db)
-            
-        else:
-            logger.warning(f"Unhandled event type: {event_type}")
-            return None
+        return handler(log, data, jobs, tasks)
             
     except Exception as e:
         logger.error(
-            f"Error processing log entry ID {log.id}, "
-            f"Job: {job_id}, Event: {event_type}: {str(e)}",
+            "Error processing log entry ID %s, Job: %s, Event: %s: %s",
+            log.id, job_id, event_type, e,
             exc_info=True
         )
         raise  # Re-raise to be handled by the caller
 
 
-def _process_job_start(log: RawLog, data: Dict[str, Any], db) -> Dict[str, Any]:
+def _process_job_start(
+    log: RawLog,
+    data: Dict[str, Any],
+    jobs: Dict[int, Dict[str, Any]],
+    tasks: Dict[str, Dict[str, Any]]
+) -> Dict[str, Any]:
     """Process a job start event."""
     job_id = log.job_id
-    logger.info(f"Processing job start - Job ID: {job_id}")
+    logger.info("Processing job start - Job ID: %s", job_id)
     
-    job = db.query(JobAnalytics).filter(JobAnalytics.job_id == job_id).first()
+    # Parse before touching the batch so a bad timestamp leaves no partial row
+    start_time = parse_timestamp(data.get("timestamp"))
     
-    if not job:
-        logger.debug(f"Creating new job entry for job_id: {job_id}")
-        job = JobAnalytics(
-            job_id=job_id,
-            user=data.get("user"),
-            start_time=data.get("timestamp"),
-            status="processing"
-        )
-    else:
-        logger.debug(f"Updating existing job entry for job_id: {job_id}")
-        job.user = data.get("user")
-        job.start_time = data.get("timestamp")
-        if not job.status:
-            job.status = "processing"
+    job = jobs.setdefault(job_id, {"job_id": job_id})
+    job["user"] = data.get("user")
+    job["start_time"] = start_time
+    if not job.get("status"):
+        job["status"] = "processing"
     
-    db.merge(job)
-    logger.info(f"Successfully processed job start for job_id: {job_id}")
+    logger.info("Successfully processed job start for job_id: %s", job_id)
     
     return {
         "job_id": job_id,
-        "user": job.user,
-        "start_time": job.start_time,
-        "status": job.status,
+        "user": job["user"],
+        "start_time": _as_utc(start_time),
+        "status": job["status"],
         "event": "job_start_processed"
     }
 
 
-def _process_job_end(log: RawLog, data: Dict[str, Any], db) -> Dict[str, Any]:
+def _process_job_end(
+    log: RawLog,
+    data: Dict[str, Any],
+    jobs: Dict[int, Dict[str, Any]],
+    tasks: Dict[str, Dict[str, Any]]
+) -> Dict[str, Any]:
     """Process a job end event."""
     job_id = log.job_id
-    logger.info(f"Processing job end - Job ID: {job_id}")
+    logger.info("Processing job end - Job ID: %s", job_id)
     
-    job = db.query(JobAnalytics).filter(JobAnalytics.job_id == job_id).first()
-    
-    if not job:
-        logger.warning(f"Job end received for non-existent job_id: {job_id}, creating entry")
-        job = JobAnalytics(job_id=job_id)
-    
-    # Update job end time and status
-    end_time = data.get("completion_time", data.get("timestamp"))
+    # Parse before touching the batch so a bad timestamp leaves no partial row
+    end_time = parse_timestamp(data.get("completion_time", data.get("timestamp")))
     status = "success" if data.get("job_result") == "JobSucceeded" else "failure"
     
-    job.end_time = end_time
-    job.status = status
+    job = jobs.setdefault(job_id, {"job_id": job_id})
+    job["end_time"] = end_time
+    job["status"] = status
     
-    db.merge(job)
-    logger.info(f"Job {job_id} marked as {status} at {end_time}")
+    logger.info("Job %s marked as %s at %s", job_id, status, end_time)
     
     return {
         "job_id": job_id,
-        "end_time": end_time,
+        "end_time": _as_utc(end_time),
         "status": status,
         "event": "job_end_processed"
     }
 
 
-def _process_task_end(log: RawLog, data: Dict[str, Any], db) -> Dict[str, Any]:
+def _process_task_end(
+    log: RawLog,
+    data: Dict[str, Any],
+    jobs: Dict[int, Dict[str, Any]],
+    tasks: Dict[str, Dict[str, Any]]
+) -> Dict[str, Any]:
     """Process a task end event."""
     job_id = log.job_id
     task_id = data.get("task_id")
@@ -301,38 +456,35 @@ def _process_task_end(log: RawLog, data: Dict[str, Any], db) -> Dict[str, Any]:
         logger.error("Task end event received without task_id")
         raise ValueError("task_id is required for task end events")
     
-    logger.debug(f"Processing task end - Job: {job_id}, Task: {task_id}")
-    
-    # Check if task already exists
-    task = db.query(TaskAnalytics).filter(
-        TaskAnalytics.task_id == task_id,
-        TaskAnalytics.job_id == job_id
-    ).first()
-    
-    if not task:
-        logger.debug(f"Creating new task entry for task_id: {task_id}")
-        task = TaskAnalytics(
-            task_id=task_id,
-            job_id=job_id
-        )
+    logger.debug("Processing task end - Job: %s, Task: %s", job_id, task_id)
     
     # Update task details
-    timestamp = data.get("timestamp")
+    timestamp = parse_timestamp(data.get("timestamp"))
     duration = data.get("duration_ms")
     successful = data.get("successful", True)
     
-    task.timestamp = timestamp
-    task.duration_ms = duration
-    task.successful = successful
-    
-    db.merge(task)
-    logger.debug(f"Processed task end - Task: {task_id}, Duration: {duration}ms, Success: {successful}")
+    tasks[task_id] = {
+        "task_id": task_id,
+        "job_id": job_id,
+        "timestamp": timestamp,
+        "duration_ms": duration,
+        "successful": successful
+    }
+    logger.debug("Processed task end - Task: %s, Duration: %sms, Success: %s", task_id, duration, successful)
     
     return {
         "job_id": job_id,
         "task_id": task_id,
-        "timestamp": timestamp,
+        "timestamp": _as_utc(timestamp),
         "duration_ms": duration,
         "successful": successful,
         "event": "task_end_processed"
     }
+
+
+# Event type -> handler; every handler takes (log, data, jobs, tasks)
+_HANDLERS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    "SparkListenerJobStart": _process_job_start,
+    "SparkListenerJobEnd": _process_job_end,
+    "SparkListenerTaskEnd": _process_task_end,
+}
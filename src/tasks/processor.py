@@ -19,8 +19,8 @@ class ProcessLog(Task):
     base=ProcessLog,
     name="processor.process_logs"
 )
-def process_logs(self):
-    analytics_data = process_raw_logs()
+def process_logs(self, log_ids=None):
+    analytics_data = process_raw_logs(log_ids)
     if not analytics_data:
         return {"status": "empty"}
     return {"job_id": analytics_data[0]["job_id"], "status": "success", "result": analytics_data[0]}
\ No newline at end of file
@@ -1,119 +1,162 @@
 import logging
-from datetime import datetime, timedelta
-from typing import List, Optional
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+from cachetools import TTLCache
+from sqlalchemy import Integer, Row, cast, func, select
 from sqlalchemy.orm import Session
-from models.logs import JobAnalytics, TaskAnalytics, JobSummary, AnalyticsSummary, AnalyticsResponse
+from models.logs import JobAnalytics, JobMetrics, SummaryVersion, JobSummary, AnalyticsSummary, AnalyticsResponse
 
-# Configure logging
+try:
+    from ciso8601 import parse_datetime as _parse_iso
+except ImportError:  # ciso8601 is optional; fall back to the standard library
+    def _parse_iso(value: str) -> datetime:
+        # fromisoformat only accepts a trailing "Z" from Python 3.11 on
+        if value.endswith("Z"):
+            value = value[:-1] + "+00:00"
+        return datetime.fromisoformat(value)
+
+# Handlers and format are configured once by the application entry point
 logger = logging.getLogger(__name__)
 
-logger.setLevel(logging.INFO)
+# (version, summary) keyed by date; past days rarely change, so they are kept longer
+_summary_cache = TTLCache(maxsize=512, ttl=60)
+_past_summary_cache = TTLCache(maxsize=512, ttl=3600)
+_summary_cache_lock = threading.Lock()
+
+# Rows fetched per round trip when streaming a day's jobs
+JOB_FETCH_BATCH_SIZE = 200
 
-# Create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
-# Create formatter and add it to the handlers
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-# Add the handlers to the logger
-logger.addHandler(ch)
+# Shared summary for days without jobs; AnalyticsSummary is frozen, so it is safe to reuse
+_EMPTY_SUMMARY = AnalyticsSummary(
+    total_jobs=0,
+    total_tasks=0,
+    failed_tasks=0,
+    avg_success_rate=0.0,
+    avg_duration_seconds=0.0
+)
 
-def calculate_job_metrics(job: JobAnalytics, db: Session) -> Optional[JobSummary]:
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
     """
-    Calculate metrics for a single job.
+    Parse an ISO 8601 event timestamp into a naive UTC datetime.
     
     Args:
-        job: JobAnalytics object
-        db: Database session
+        value: ISO 8601 timestamp, optionally ending in "Z" or a UTC offset
         
     Returns:
-        Optional[JobSummary]: Calculated job metrics or None if calculation fails
-    """
-    try:
-        logger.info(f"Calculating metrics for job_id: {job.job_id}")
-        
-        # Log job details
-        logger.debug(f"Job details - ID: {job.job_id}, User: {job.user}, Status: {job.status}")
-        
-        # Query tasks for the job
-        tasks = db.query(TaskAnalytics).filter(TaskAnalytics.job_id == job.job_id).all()
-        task_count = len(tasks)
-        failed_tasks = sum(1 for t in tasks if not t.successful)
+        Optional[datetime]: Naive UTC datetime, or None if no timestamp was given
         
-        logger.debug(f"Found {task_count} tasks with {failed_tasks} failed tasks")
-        
-        # Calculate success rate with safe division
-        success_rate = 0.0
-        if task_count > 0:
-            success_rate = round(100 * (task_count - failed_tasks) / task_count, 2)
-        
-        # Calculate duration if both start and end times are available
-        duration = None
-        if job.start_time and job.end_time:
-            try:
-                start_dt = datetime.fromisoformat(job.start_time.replace("Z", "+00:00"))
-                end_dt = datetime.fromisoformat(job.end_time.replace("Z", "+00:00"))
-                duration = int((end_dt - start_dt).total_seconds())
-                logger.debug(f"Job duration: {duration} seconds")
-            except Exception as e:
-                logger.error(f"Error calculating duration for job {job.job_id}: {str(e)}")
-                logger.debug(f"start_time: {job.start_time}, end_time: {job.end_time}")
-        else:
-            logger.warning(f"Missing time data for job {job.job_id} - start_time: {job.start_time}, end_time: {job.end_time}")
+    Raises:
+        ValueError: If the timestamp is not valid ISO 8601
+    """
+    if not value:
+        return None
+    parsed = _parse_iso(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Mark a stored naive UTC datetime as UTC so it serializes with its offset."""
+    return value.replace(tzinfo=timezone.utc) if value else None
+
+def _duration_seconds(start, end):
+    """
+    SQL expression for the whole seconds between two DateTime columns.
+    
+    julianday() is a float number of days, so the difference is rounded to
+    the millisecond before CAST truncates it; otherwise 78s can come back
+    as 77.99999 and truncate to 77. NULL if either column is NULL.
+    """
+    return cast(func.round((func.julianday(end) - func.julianday(start)) * 86400, 3), Integer)
+
+def calculate_job_metrics(job: Row) -> JobSummary:
+    """
+    Calculate metrics for a single job.
+    
+    Args:
+        job: Row from get_jobs_for_date_range with the job's columns, its
+            task_count and failed_tasks, and its duration in whole seconds
+            (None if the job has no start or end time)
         
-        # Create and return job summary
-        job_summary = JobSummary(
-            job_id=job.job_id,
-            user=job.user,
-            start_time=job.start_time,
-            end_time=job.end_time,
-            status=job.status,
-            task_count=task_count,
-            failed_tasks=failed_tasks,
-            success_rate=success_rate,
-            duration_seconds=duration
+    Returns:
+        JobSummary: Calculated job metrics
+    """
+    task_count = job.task_count
+    failed_tasks = job.failed_tasks
+    duration = job.duration
+    
+    # Calculate success rate with safe division
+    success_rate = 0.0
+    if task_count > 0:
+        success_rate = 100 * (task_count - failed_tasks) / task_count
+    
+    if duration is None:
+        logger.warning(
+            "Missing time data for job %s - start_time: %s, end_time: %s",
+            job.job_id, job.start_time, job.end_time
         )
-        
-        logger.info(f"Successfully calculated metrics for job_id: {job.job_id}")
-        return job_summary
-        
-    except Exception as e:
-        logger.error(f"Error calculating metrics for job {job.job_id if job else 'unknown'}: {str(e)}", exc_info=True)
-        return None
+    
+    # Values come from typed columns and SQL aggregates, so skip validation
+    job_summary = JobSummary.model_construct(
+        job_id=job.job_id,
+        user=job.user,
+        start_time=_as_utc(job.start_time),
+        end_time=_as_utc(job.end_time),
+        status=job.status,
+        task_count=task_count,
+        failed_tasks=failed_tasks,
+        success_rate=success_rate,
+        duration_seconds=duration
+    )
+    
+    # One summary line per job, built only when DEBUG is enabled
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Calculated metrics for job %s - User: %s, Status: %s, Tasks: %s, Failed: %s, Duration: %ss",
+            job.job_id, job.user, job.status, task_count, failed_tasks, duration
+        )
+    return job_summary
 
-def get_jobs_for_date_range(db: Session, start_date: datetime, end_date: datetime) -> List[JobAnalytics]:
+def get_jobs_for_date_range(
+    db: Session, start_date: datetime, end_date: datetime
+) -> Iterator[Row]:
     """
-    Retrieve jobs within a date range.
+    Retrieve jobs within a date range together with their task counts and duration.
+    
+    Task counts are read from job_metrics, which triggers keep up to date as
+    task_analytics changes, so no task rows are aggregated at read time. The
+    duration is computed by the database as well. Only the needed columns are
+    selected, so no JobAnalytics objects are built.
     
     Args:
         db: Database session
-        start_date: Start of date range
-        end_date: End of date range
+        start_date: Start of date range (inclusive)
+        end_date: End of date range (exclusive); callers pass it after start_date
         
     Returns:
-        List[JobAnalytics]: List of jobs in the date range
+        Iterator[Row]: Jobs in the date range (job_id, user, start_time,
+        end_time, status) with their task_count, failed_tasks and duration in
+        seconds. Rows are streamed in batches as the caller iterates.
     """
-    try:
-        logger.info(f"Fetching jobs between {start_date.isoformat()} and {end_date.isoformat()}")
-        
-        # Validate input dates
-        if start_date > end_date:
-            logger.warning(f"Start date {start_date} is after end date {end_date}")
-            return []
-        
-        # Execute query
-        jobs = db.query(JobAnalytics).filter(
-            JobAnalytics.start_time >= start_date.isoformat(),
-            JobAnalytics.start_time < end_date.isoformat()
-        ).all()
-        
-        logger.info(f"Found {len(jobs)} jobs in the specified date range")
-        return jobs
-        
-    except Exception as e:
-        logger.error(f"Error fetching jobs from database: {str(e)}", exc_info=True)
-        # Return empty list on error to prevent cascading failures
-        return []
+    logger.info("Fetching jobs between %s and %s", start_date, end_date)
+    
+    stmt = select(
+        JobAnalytics.job_id,
+        JobAnalytics.user,
+        JobAnalytics.start_time,
+        JobAnalytics.end_time,
+        JobAnalytics.status,
+        func.coalesce(JobMetrics.task_count, 0).label("task_count"),
+        func.coalesce(JobMetrics.failed_tasks, 0).label("failed_tasks"),
+        _duration_seconds(JobAnalytics.start_time, JobAnalytics.end_time).label("duration")
+    ).outerjoin(
+        JobMetrics, JobMetrics.job_id == JobAnalytics.job_id
+    ).where(
+        JobAnalytics.start_time >= start_date,
+        JobAnalytics.start_time < end_date
+    ).execution_options(yield_per=JOB_FETCH_BATCH_SIZE)
+    return db.execute(stmt)
 
 def calculate_summary_metrics(job_summaries: List[JobSummary]) -> AnalyticsSummary:
     """
@@ -125,39 +168,39 @@ def calculate_summary_metrics(job_summaries: List[JobSummary]) -> AnalyticsSumma
     Returns:
         AnalyticsSummary: Calculated summary metrics
     """
-    logger.info(f"Calculating summary metrics for {len(job_summaries)} jobs")
+    logger.info("Calculating summary metrics for %d jobs", len(job_summaries))
     
     total_jobs = len(job_summaries)
     if not total_jobs:
         logger.info("No job summaries provided, returning empty summary")
-        return AnalyticsSummary(
-            total_jobs=0,
-            total_tasks=0,
-            failed_tasks=0,
-            avg_success_rate=0.0,
-            avg_duration_seconds=0.0
-        )
+        return _EMPTY_SUMMARY
 
     try:
-        # Calculate basic metrics
-        total_tasks = sum(js.task_count for js in job_summaries)
-        failed_tasks = sum(js.failed_tasks for js in job_summaries)
-        
-        # Calculate success rate
-        success_rates = [js.success_rate for js in job_summaries if js.success_rate is not None]
-        avg_success_rate = round(sum(success_rates) / len(success_rates), 2) if success_rates else 0.0
+        # Accumulate all totals in one pass over the job summaries
+        total_tasks = failed_tasks = 0
+        success_sum = 0.0
+        duration_sum = 0
+        duration_count = 0
+        for js in job_summaries:
+            total_tasks += js.task_count
+            failed_tasks += js.failed_tasks
+            # success_rate is always set (0.0 for jobs without tasks)
+            success_sum += js.success_rate
+            duration = js.duration_seconds
+            # Average duration excludes jobs without one
+            if duration is not None:
+                duration_sum += duration
+                duration_count += 1
         
-        # Calculate average duration excluding None values
-        durations = [js.duration_seconds for js in job_summaries if js.duration_seconds is not None]
-        avg_duration = round(sum(durations) / len(durations), 2) if durations else 0.0
+        avg_success_rate = success_sum / total_jobs
+        avg_duration = duration_sum / duration_count if duration_count else 0.0
         
         logger.debug(
-            f"Summary - Jobs: {total_jobs}, Tasks: {total_tasks}, "
-            f"Failed: {failed_tasks}, Success Rate: {avg_success_rate}%, "
-            f"Avg Duration: {avg_duration}s"
+            "Summary - Jobs: %s, Tasks: %s, Failed: %s, Success Rate: %s%%, Avg Duration: %ss",
+            total_jobs, total_tasks, failed_tasks, avg_success_rate, avg_duration
         )
         
-        return AnalyticsSummary(
+        return AnalyticsSummary.model_construct(
             total_jobs=total_jobs,
             total_tasks=total_tasks,
             failed_tasks=failed_tasks,
@@ -166,95 +209,114 @@ def calculate_summary_metrics(job_summaries: List[JobSummary]) -> AnalyticsSumma
         )
         
     except Exception as e:
-        logger.error(f"Error calculating summary metrics: {str(e)}", exc_info=True)
+        logger.error("Error calculating summary metrics: %s", e, exc_info=True)
         # Return empty summary on error
-        return AnalyticsSummary(
-            total_jobs=0,
-            total_tasks=0,
-            failed_tasks=0,
-            avg_success_rate=0.0,
-            avg_duration_seconds=0.0
-        )
+        return _EMPTY_SUMMARY
+
+def _get_summary_cache(date: str) -> TTLCache:
+    """Return the summary cache for a date, depending on whether it is in the past."""
+    if date < datetime.utcnow().date().isoformat():
+        return _past_summary_cache
+    return _summary_cache
 
-def get_analytics_summary_data(db: Session, date: str) -> AnalyticsResponse:
+def get_summary_version(db: Session, date: str) -> int:
+    """
+    Get the current analytics version for a date.
+    
+    The worker bumps it whenever it writes analytics for jobs that start on
+    that date, so a cached summary is only valid for the version it was
+    computed at.
+    
+    Args:
+        db: Database session
+        date: Date string in YYYY-MM-DD format
+        
+    Returns:
+        int: Current version, 0 if the date's analytics were never written
+    """
+    version = db.scalar(select(SummaryVersion.version).where(SummaryVersion.date == date))
+    return version or 0
+
+def get_analytics_summary_data(db: Session, date: str) -> Dict[str, Any]:
     """
     Get analytics summary data for a specific date.
     
+    The AnalyticsResponse is dumped once into a plain dict, ready for JSON
+    encoding. Computed summaries are cached in that form per date together
+    with the date's analytics version, and are recomputed once the worker
+    has bumped it. Empty or failed results are not cached.
+    
     Args:
         db: Database session
         date: Date string in YYYY-MM-DD format
         
     Returns:
-        AnalyticsResponse: Analytics data for the specified date
+        Dict[str, Any]: Dumped AnalyticsResponse for the specified date
         
     Raises:
         ValueError: If the date format is invalid
     """
-    logger.info(f"Generating analytics summary for date: {date}")
+    # Read the version before computing, so a concurrent write leaves the
+    # cached entry outdated instead of hiding it
+    version = get_summary_version(db, date)
+    cache = _get_summary_cache(date)
+    with _summary_cache_lock:
+        cached = cache.get(date)
+    if cached is not None and cached[0] == version:
+        logger.info("Serving cached analytics for %s", date)
+        return cached[1]
+    
+    logger.info("Generating analytics summary for date: %s", date)
     
     try:
         # Validate and parse the input date
         try:
-            query_date = datetime.strptime(date, "%Y-%m-%d")
-            logger.debug(f"Parsed query date: {query_date}")
+            query_date = datetime.fromisoformat(date)
+            logger.debug("Parsed query date: %s", query_date)
         except ValueError as e:
-            logger.error(f"Invalid date format: {date}. Expected YYYY-MM-DD")
+            logger.error("Invalid date format: %s. Expected YYYY-MM-DD", date)
             raise ValueError("Invalid date format. Use YYYY-MM-DD") from e
         
         # Define date range for the query
         next_day = query_date + timedelta(days=1)
-        logger.debug(f"Querying jobs between {query_date} and {next_day}")
         
-        # Get jobs for the date range
-        jobs = get_jobs_for_date_range(db, query_date, next_day)
+        # Calculate metrics for each job as its row is streamed in
+        job_summaries = [
+            calculate_job_metrics(job)
+            for job in get_jobs_for_date_range(db, query_date, next_day)
+        ]
         
         # Handle case where no jobs are found
-        if not jobs:
-            logger.info(f"No jobs found for date: {date}")
-            return AnalyticsResponse(
+        if not job_summaries:
+            logger.info("No jobs found for date: %s", date)
+            return AnalyticsResponse.model_construct(
                 date=date,
-                summary=AnalyticsSummary(
-                    total_jobs=0,
-                    total_tasks=0,
-                    failed_tasks=0,
-                    avg_success_rate=0.0,
-                    avg_duration_seconds=0.0
-                ),
+                summary=_EMPTY_SUMMARY,
                 jobs=[]
-            )
-        
-        # Calculate metrics for each job
-        logger.info(f"Processing {len(jobs)} jobs for analytics summary")
-        job_summaries = []
-        for job in jobs:
-            summary = calculate_job_metrics(job, db)
-            if summary:  # Only include valid summaries
-                job_summaries.append(summary)
+            ).model_dump()
         
         # Calculate overall summary
         summary = calculate_summary_metrics(job_summaries)
-        logger.info(f"Generated summary for {len(job_summaries)} jobs: {summary}")
+        logger.info("Generated summary for %d jobs: %s", len(job_summaries), summary)
         
         # Prepare and return the response
-        response = AnalyticsResponse(
+        response = AnalyticsResponse.model_construct(
             date=date,
             summary=summary,
             jobs=job_summaries
-        )
+        ).model_dump()
+        # calculate_summary_metrics falls back to the empty summary on error
+        if summary is not _EMPTY_SUMMARY:
+            with _summary_cache_lock:
+                cache[date] = (version, response)
         
         return response
         
     except Exception as e:
-        logger.error(f"Error generating analytics summary for date {date}: {str(e)}", exc_info=True)
+        logger.error("Error generating analytics summary for date %s: %s", date, e, exc_info=True)
         # Return empty response on error
-        return AnalyticsResponse(
+        return AnalyticsResponse.model_construct(
             date=date,
-            summary=AnalyticsSummary(
-                total_jobs=0,
-                total_tasks=0,
-                failed_tasks=0,
-                avg_success_rate=0.0,
-                avg_duration_seconds=0.0
-            ),
+            summary=_EMPTY_SUMMARY,
             jobs=[]
-        )
+        ).model_dump()